@@ -10,12 +10,16 @@ import logging
 
 import numpy as np
 import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+from scipy.sparse.csgraph import reverse_cuthill_mckee
 import matplotlib.pyplot as plt
 from matplotlib.colors import LogNorm
 
-from rbf.sputils import expand_rows
-from rbf.linalg import GMRESSolver
-from rbf.pde.fd import weight_matrix
+from rbf.sputils import (
+    row_norms, divide_rows, shared_pattern_dot, parallel_dot
+    )
+from rbf.linalg import MILU0Solver
+from rbf.pde.fd import weight_matrices
 from rbf.pde.nodes import poisson_disc_nodes
 
 logging.basicConfig(level=logging.DEBUG)
@@ -35,6 +39,9 @@ lamb = 1.0
 mu = 1.0
 # z component of body for
 body_force = 1.0
+# systems with fewer unknowns than this are solved directly, larger systems are
+# solved iteratively
+max_direct_size = 1000
 
 ## Build and solve for displacements and strain
 #####################################################################
@@ -66,25 +73,24 @@ diffs_yx = [(1, 1), (1, 1)]
 # y component of force resulting from displacement in the y direction.
 coeffs_yy = [lamb+2*mu, mu]
 diffs_yy =  [(0, 2), (2, 0)]
+diffs = [diffs_xx, diffs_xy, diffs_yx, diffs_yy]
+coeffs = [coeffs_xx, coeffs_xy, coeffs_yx, coeffs_yy]
 # make the differentiation matrices that enforce the PDE on the interior nodes.
-D_xx = weight_matrix(nodes[groups['interior']], nodes, n, diffs_xx, coeffs=coeffs_xx)
-D_xy = weight_matrix(nodes[groups['interior']], nodes, n, diffs_xy, coeffs=coeffs_xy)
-D_yx = weight_matrix(nodes[groups['interior']], nodes, n, diffs_yx, coeffs=coeffs_yx)
-D_yy = weight_matrix(nodes[groups['interior']], nodes, n, diffs_yy, coeffs=coeffs_yy)
-G_xx = expand_rows(D_xx, groups['interior'], N)
-G_xy = expand_rows(D_xy, groups['interior'], N)
-G_yx = expand_rows(D_yx, groups['interior'], N)
-G_yy = expand_rows(D_yy, groups['interior'], N)
+# `weight_matrices` finds the stencils and builds the RBF-FD systems once for
+# all four components. `row_map` places the rows for each target node in the
+# corresponding row of the (N, N) output matrices.
+G_xx, G_xy, G_yx, G_yy = weight_matrices(
+    nodes[groups['interior']], nodes, n, diffs, coeffs=coeffs,
+    row_map=groups['interior'])
 
 # use the ghost nodes to enforce the PDE on the boundary
-D_xx = weight_matrix(nodes[groups['boundary:free']], nodes, n, diffs_xx, coeffs=coeffs_xx)
-D_xy = weight_matrix(nodes[groups['boundary:free']], nodes, n, diffs_xy, coeffs=coeffs_xy)
-D_yx = weight_matrix(nodes[groups['boundary:free']], nodes, n, diffs_yx, coeffs=coeffs_yx)
-D_yy = weight_matrix(nodes[groups['boundary:free']], nodes, n, diffs_yy, coeffs=coeffs_yy)
-G_xx += expand_rows(D_xx, groups['ghosts:free'], N)
-G_xy += expand_rows(D_xy, groups['ghosts:free'], N)
-G_yx += expand_rows(D_yx, groups['ghosts:free'], N)
-G_yy += expand_rows(D_yy, groups['ghosts:free'], N)
+D_xx, D_xy, D_yx, D_yy = weight_matrices(
+    nodes[groups['boundary:free']], nodes, n, diffs, coeffs=coeffs,
+    row_map=groups['ghosts:free'])
+G_xx += D_xx
+G_xy += D_xy
+G_yx += D_yx
+G_yy += D_yy
 
 ## Enforce fixed boundary conditions
 # Enforce that x and y are as specified with the fixed boundary condition.
@@ -97,10 +103,12 @@ diffs_xx = [(0, 0)]
 coeffs_yy = [1.0]
 diffs_yy = [(0, 0)]
 
-dD_fix_xx = weight_matrix(nodes[groups['boundary:fixed']], nodes, n, diffs_xx, coeffs=coeffs_xx)
-dD_fix_yy = weight_matrix(nodes[groups['boundary:fixed']], nodes, n, diffs_yy, coeffs=coeffs_yy)
-G_xx += expand_rows(dD_fix_xx, groups['boundary:fixed'], N)
-G_yy += expand_rows(dD_fix_yy, groups['boundary:fixed'], N)
+dD_fix_xx, dD_fix_yy = weight_matrices(
+    nodes[groups['boundary:fixed']], nodes, n, [diffs_xx, diffs_yy],
+    coeffs=[coeffs_xx, coeffs_yy],
+    row_map=groups['boundary:fixed'])
+G_xx += dD_fix_xx
+G_yy += dD_fix_yy
 
 ## Enforce free surface boundary conditions
 # x component of traction force resulting from x displacement 
@@ -121,15 +129,16 @@ coeffs_yy = [normals[groups['boundary:free']][:, 1]*(lamb+2*mu),
 diffs_yy =  [(0, 1), (1, 0)]
 # make the differentiation matrices that enforce the free surface boundary 
 # conditions.
-dD_free_xx = weight_matrix(nodes[groups['boundary:free']], nodes, n, diffs_xx, coeffs=coeffs_xx)
-dD_free_xy = weight_matrix(nodes[groups['boundary:free']], nodes, n, diffs_xy, coeffs=coeffs_xy)
-dD_free_yx = weight_matrix(nodes[groups['boundary:free']], nodes, n, diffs_yx, coeffs=coeffs_yx)
-dD_free_yy = weight_matrix(nodes[groups['boundary:free']], nodes, n, diffs_yy, coeffs=coeffs_yy)
+dD_free_xx, dD_free_xy, dD_free_yx, dD_free_yy = weight_matrices(
+    nodes[groups['boundary:free']], nodes, n,
+    [diffs_xx, diffs_xy, diffs_yx, diffs_yy],
+    coeffs=[coeffs_xx, coeffs_xy, coeffs_yx, coeffs_yy],
+    row_map=groups['boundary:free'])
 
-G_xx += expand_rows(dD_free_xx, groups['boundary:free'], N)
-G_xy += expand_rows(dD_free_xy, groups['boundary:free'], N)
-G_yx += expand_rows(dD_free_yx, groups['boundary:free'], N)
-G_yy += expand_rows(dD_free_yy, groups['boundary:free'], N)
+G_xx += dD_free_xx
+G_xy += dD_free_xy
+G_yx += dD_free_yx
+G_yy += dD_free_yy
 
 # stack the components together to form the left-hand-side matrix
 G_x = sp.hstack((G_xx, G_xy))
@@ -152,8 +161,52 @@ d_y[groups['boundary:fixed']] = 0.0
 
 d = np.hstack((d_x, d_y))
 
-# solve the system!
-u = GMRESSolver(G).solve(d)
+# solve the system! Small systems are solved with a direct LU decomposition.
+# Larger systems are solved with BiCGSTAB using an incomplete LU decomposition
+# with zero fill-in, ILU(0), as the preconditioner, which avoids the fill-in of
+# a full LU decomposition.
+G = G.tocsc()
+if G.shape[0] < max_direct_size:
+    u = spla.spsolve(G, d)
+else:
+    # normalize the rows of `G` to improve the conditioning of the system
+    norms = row_norms(G)
+    G = divide_rows(G, norms).tocsr()
+    d = d/norms
+
+    # reorder the unknowns with the reverse Cuthill-McKee algorithm, which
+    # reduces the bandwidth of `G` and improves the preconditioner. The
+    # ordering is found for the nodes, and then the x and y displacements for
+    # each node are interleaved so that `G` is made of 2x2 blocks.
+    node_graph = abs(G_xx) + abs(G_xy) + abs(G_yx) + abs(G_yy)
+    node_perm = reverse_cuthill_mckee(
+        (node_graph + node_graph.T).tocsr(), symmetric_mode=True)
+    perm = np.column_stack((node_perm, node_perm + N)).ravel()
+    G = G[perm][:, perm]
+    d = d[perm]
+
+    # Do not lump the dropped fill-in into the diagonal (relax=0). The fully
+    # modified factorization (relax=1) is a poor preconditioner for this
+    # operator and BiCGSTAB diverges with it on finer node sets.
+    milu = MILU0Solver(G, relax=0.0)
+    M = spla.LinearOperator(G.shape, milu.solve)
+    # use a multithreaded sparse matrix-vector product for the iterations
+    A = spla.LinearOperator(G.shape, matvec=lambda v: parallel_dot(G, v))
+
+    def callback(uk, _itr=[0]):
+        _itr[0] += 1
+        logging.debug('BiCGSTAB iteration %s' % _itr[0])
+
+    u, info = spla.bicgstab(A, d, M=M, tol=1e-8, atol=1e-10, callback=callback)
+    if info != 0:
+        # do not continue with a diverged solution, fall back to a direct solve
+        logging.warning(
+            'BiCGSTAB did not converge (info=%s). Solving the system directly '
+            'instead.' % info)
+        u = spla.spsolve(G.tocsc(), d)
+
+    # undo the reordering
+    u = u[np.argsort(perm)]
 
 # reshape the solution
 u = np.reshape(u, (2, -1))
@@ -163,11 +216,13 @@ u_x, u_y = u
 x, y = np.meshgrid(np.linspace(0.0, 2.0, 100), np.linspace(0.0, 1.0, 50))
 points = np.array([x.flatten(), y.flatten()]).T
 
-D_x = weight_matrix(points, nodes, n, (1, 0))
-D_y = weight_matrix(points, nodes, n, (0, 1))
-e_xx = D_x.dot(u_x)
-e_yy = D_y.dot(u_y)
-e_xy = 0.5*(D_y.dot(u_x) + D_x.dot(u_y))
+D_x, D_y = weight_matrices(points, nodes, n, [(1, 0), (0, 1)])
+# `D_x` and `D_y` have the same sparsity pattern, so the x and y derivatives of
+# both displacement components are computed with a single pass over it
+du_dx, du_dy = shared_pattern_dot([D_x, D_y], np.column_stack((u_x, u_y)))
+e_xx = du_dx[:, 0]
+e_yy = du_dy[:, 1]
+e_xy = 0.5*(du_dy[:, 0] + du_dx[:, 1])
 # calculate second strain invariant
 I2 = np.sqrt(e_xx**2 + e_yy**2 + 2*e_xy**2)
 
@@ -0,0 +1,2 @@
+__git_hash__ = "a20d5298a2f9fceb005537ddfafce6cd113abbb5"
+__version__ = "a20d529+dirty"
@@ -50,19 +50,63 @@ Scientific Publishing Co.
 
 '''
 import logging
+import hashlib
+import weakref
 
 import numpy as np
 import scipy.sparse as sp
 from scipy.optimize import minimize
 
 from rbf.linalg import Solver, PosDefSolver, PartitionedSolver
-from rbf.poly import monomial_count, mvmonos
+from rbf.poly import monomial_count, monomial_powers, mvmonos
 from rbf.basis import get_rbf, SparseRBF
 from rbf.utils import assert_shape, KDTree
 
 
 logger = logging.getLogger(__name__)
 
+# When evaluating an interpolant, the kernel matrix is built in blocks of
+# observation points with roughly this many bytes, so that each block fits in
+# the L2 cache instead of forming the full kernel matrix.
+_KERNEL_BLOCK_BYTES = 256*1024
+# minimum number of observation points in each block of the kernel matrix. This
+# bounds the Python overhead when there are many evaluation points.
+_MIN_KERNEL_BLOCK_SIZE = 128
+# KD-trees for the observation points of neighbor-based interpolants. The trees
+# are shared between interpolants with the same observation points, and they
+# are released when no interpolant is using them.
+_KDTREE_CACHE = weakref.WeakValueDictionary()
+# If the number of observations is at least this many times the number of
+# neighbors, the KD-tree is built without balancing.
+_UNBALANCED_KDTREE_RATIO = 10
+
+
+def _get_kdtree(y, balanced=True):
+    '''
+    Returns a KD-tree for `y`, reusing a cached tree if one exists for the same
+    points. If `balanced` is False then a new tree is built by splitting at the
+    midpoint of each node rather than the median, which is faster to build but
+    slightly slower to query.
+    '''
+    # the key is based on the contents of `y` rather than its memory address,
+    # which may be reused after `y` is garbage collected. A digest of the
+    # contents is used so that the key does not hold a copy of `y`, and the
+    # points in a cached tree are compared with `y` in case of a collision.
+    y = np.ascontiguousarray(y)
+    key = (y.shape, y.dtype.str, hashlib.sha1(y).digest())
+    tree = _KDTREE_CACHE.get(key)
+    if (tree is None) or not np.array_equal(tree.data, y):
+        if balanced:
+            tree = KDTree(y)
+        else:
+            tree = KDTree(
+                y, leafsize=32, balanced_tree=False, compact_nodes=False
+                )
+
+        _KDTREE_CACHE[key] = tree
+
+    return tree
+
 
 def _gml(d, K, P):
     '''
@@ -354,7 +398,8 @@ def _build_and_solve_systems(y, d, sigma, phi, eps, order, check_cond):
 
     eps : float
 
-    order : int
+    order : int or (R, D) int array
+        Polynomial order or the powers for each monomial.
 
     Returns
     -------
@@ -408,11 +453,35 @@ def _build_and_solve_systems(y, d, sigma, phi, eps, order, check_cond):
         rhs = np.zeros(bcast + (n + r, s), dtype=float)
         rhs[..., :n, :] = d
         if len(bcast) == 0:
+            coeff = None
             # Transpose LHS (which is symmetric) to make it fortran contiguous
             # so that it can be factored inplace. It was C contiguous up to
             # this point to speed up construction.
-            solver = Solver(LHS.T, check_cond=check_cond, factor_inplace=True)
-            coeff = solver.solve(rhs)
+            if (r == 0) and (phi.cpd_order == 0):
+                # Without polynomial terms, LHS is positive definite for a
+                # positive definite RBF, so try a Cholesky factorization,
+                # which is about twice as fast as an LU factorization.
+                try:
+                    solver = PosDefSolver(
+                        LHS.T, factor_inplace=True, check_cond=check_cond
+                        )
+                    coeff = solver.solve(rhs)
+                except np.linalg.LinAlgError:
+                    logger.debug(
+                        'The RBF interpolation matrix is not numerically '
+                        'positive definite. Using an LU factorization '
+                        'instead.'
+                        )
+                    # the failed factorization overwrote LHS
+                    phi(y, y, eps=eps, out=LHS)
+                    LHS[range(n), range(n)] += sigma**2
+
+            if coeff is None:
+                solver = Solver(
+                    LHS.T, check_cond=check_cond, factor_inplace=True
+                    )
+                coeff = solver.solve(rhs)
+
         else:
             # This runs when `neighbors` is given. `Solver` does not support
             # solving multiple systems simultaneously, and `np.linalg.solve` is
@@ -476,6 +545,15 @@ class RBFInterpolant(object):
         Whether to check the condition number of the system being solved. A
         warning is raised if it is ill-conditioned.
 
+    dtype_eval : numpy float dtype, optional
+        Precision of the stored RBF coefficients and the kernel matrix when
+        evaluating the interpolant. Setting this to `np.float32` halves the
+        memory for the coefficients at the expense of accuracy. It does not
+        make evaluation faster because the RBF is still computed in double
+        precision. The coefficients are always solved for in double precision,
+        and the output is always accumulated in double precision. This is
+        ignored if `neighbors` is given. Defaults to `np.float64`.
+
     Notes
     -----
     If `sigma` or `eps` are set to "auto", they are optimized with a single run
@@ -525,7 +603,12 @@ class RBFInterpolant(object):
                  eps=1.0,
                  order=None,
                  neighbors=None,
-                 check_cond=True):
+                 check_cond=True,
+                 dtype_eval=np.float64):
+        dtype_eval = np.dtype(dtype_eval)
+        if not np.issubdtype(dtype_eval, np.floating):
+            raise ValueError('`dtype_eval` must be a floating point type.')
+
         sigma, eps = _optimal_sigma_and_eps(y, d, sigma, phi, eps, order)
 
         y, d, sigma, phi, eps, order, neighbors = _sanitize_arguments(
@@ -537,19 +620,25 @@ class RBFInterpolant(object):
         d = d.reshape((d.shape[0], -1))
         # If d is complex, turn it into a float with twice as many columns
         d = d.view(float)
+        # the monomial powers only depend on `order` and the dimensions, so
+        # they are found once and reused for every evaluation
+        pwr = monomial_powers(order, y.shape[1])
 
         if neighbors is None:
             phi_coeff, poly_coeff, shift, scale = _build_and_solve_systems(
-                y, d, sigma, phi, eps, order, check_cond
+                y, d, sigma, phi, eps, pwr, check_cond
                 )
 
-            self.phi_coeff = phi_coeff
+            self.phi_coeff = phi_coeff.astype(dtype_eval, copy=False)
             self.poly_coeff = poly_coeff
             self.shift = shift
             self.scale = scale
 
         else:
-            self.tree = KDTree(y)
+            # the query penalty for an unbalanced tree is small when the
+            # neighborhoods are small relative to the number of observations
+            balanced = neighbors*_UNBALANCED_KDTREE_RATIO > y.shape[0]
+            self.tree = _get_kdtree(y, balanced=balanced)
 
         self.y = y
         self.d = d
@@ -557,7 +646,9 @@ class RBFInterpolant(object):
         self.phi = phi
         self.eps = eps
         self.order = order
+        self.pwr = pwr
         self.neighbors = neighbors
+        self.dtype_eval = dtype_eval
 
 
     def __call__(self, x, diff=None, chunk_size=1000):
@@ -601,10 +692,34 @@ class RBFInterpolant(object):
             return out
 
         if self.neighbors is None:
-            Kxy = self.phi(x, self.y, eps=self.eps, diff=diff)
-            Px = mvmonos((x - self.shift)/self.scale, self.order, diff=diff)
+            Px = mvmonos((x - self.shift)/self.scale, self.pwr, diff=diff)
             Px /= np.prod(self.scale**diff)
-            out = Kxy.dot(self.phi_coeff) + Px.dot(self.poly_coeff)
+            out = Px.dot(self.poly_coeff)
+            if isinstance(self.phi, SparseRBF):
+                # the sparse kernel matrix does not need to be built in
+                # blocks, and each evaluation involves a neighbor search
+                Kxy = self.phi(x, self.y, eps=self.eps, diff=diff)
+                Kxy = Kxy.astype(self.dtype_eval, copy=False)
+                out += Kxy.dot(self.phi_coeff)
+
+            else:
+                # accumulate the RBF terms for blocks of observation points.
+                # Each block is evaluated directly into a buffer with the
+                # evaluation precision
+                nobs = self.y.shape[0]
+                block_size = max(
+                    _KERNEL_BLOCK_BYTES//(self.dtype_eval.itemsize*max(n, 1)),
+                    _MIN_KERNEL_BLOCK_SIZE
+                    )
+                buf = np.empty((n, block_size), dtype=self.dtype_eval)
+                for start in range(0, nobs, block_size):
+                    stop = min(start + block_size, nobs)
+                    Kxy = buf[:, :stop - start]
+                    self.phi(
+                        x, self.y[start:stop], eps=self.eps, diff=diff,
+                        out=Kxy
+                        )
+                    out += Kxy.dot(self.phi_coeff[start:stop])
 
         else:
             # get the indices of the k-nearest observations for each
@@ -618,7 +733,7 @@ class RBFInterpolant(object):
             # Get the observation data for each neighborhood
             y, d, sigma = self.y[nbr], self.d[nbr], self.sigma[nbr]
             phi_coeff, poly_coeff, shift, scale = _build_and_solve_systems(
-                y, d, sigma, self.phi, self.eps, self.order, False
+                y, d, sigma, self.phi, self.eps, self.pwr, False
                 )
 
             # expand the arrays from having one entry per neighborhood to one
@@ -630,11 +745,13 @@ class RBFInterpolant(object):
             poly_coeff = poly_coeff[inv]
 
             Kxy = self.phi(x[:, None], y, eps=self.eps, diff=diff)[:, 0, :]
-            Px = mvmonos((x - shift)/scale, self.order, diff=diff)
+            Px = mvmonos((x - shift)/scale, self.pwr, diff=diff)
             Px /= np.prod(scale**diff, axis=1)[:, None]
+            # contract over the neighbors and monomials without forming the
+            # (N, k, S) and (N, R, S) products
             out = (
-                np.sum(Kxy[:, :, None]*phi_coeff, axis=1) +
-                np.sum(Px[:, :, None]*poly_coeff, axis=1)
+                np.einsum('ij,ijk->ik', Kxy, phi_coeff) +
+                np.einsum('ij,ijk->ik', Px, poly_coeff)
                 )
 
         out = out.view(self.d_dtype)
@@ -11,10 +11,13 @@ import scipy.sparse as sp
 from scipy.linalg.misc import LinAlgWarning
 import scipy.sparse.linalg as spla
 from scipy.linalg.lapack import (
-    dpotrf, dpotrs, dtrtrs, dgetrf, dgetrs, dgecon, dlange, dlamch
+    dpotrf, dpotrs, dpocon, dtrtrs, dgetrf, dgetrs, dgecon, dlange, dlamch
     )
 
-from rbf.sputils import row_norms, divide_rows
+from rbf.sputils import (
+    row_norms, divide_rows, _csr_milu0, _csr_milu0_solve
+    )
+from rbf.utils import assert_shape
 
 LOGGER = logging.getLogger(__name__)
 
@@ -33,6 +36,20 @@ except ImportError:
 ## Wrappers for low level LAPACK functions. These are all a few microseconds
 ## faster than their corresponding functions in scipy.linalg
 ###############################################################################
+def _warn_if_ill_conditioned(rcond):
+    '''
+    Warns if the reciprocal condition number `rcond` is below the machine
+    precision, which is the same criteria used by `scipy.linalg.solve`.
+    '''
+    tol = dlamch('E')
+    if rcond < tol:
+        warnings.warn(
+            "Ill-conditioned matrix (rcond=%.6g). The solution "
+            "may not be accurate." % rcond,
+            LinAlgWarning
+            )
+
+
 def _lu(A, check_cond, factor_inplace):
     '''
     Computes the LU factorization of `A` using `dgetrf`.
@@ -56,30 +73,31 @@ def _lu(A, check_cond, factor_inplace):
 
     if check_cond:
         rcond, _ = dgecon(fac, A_norm, norm='1')
-        tol = dlamch('E')
-        if rcond < tol:
-            warnings.warn(
-                "Ill-conditioned matrix (rcond=%.6g). The solution "
-                "may not be accurate." % rcond,
-                LinAlgWarning
-                )
+        _warn_if_ill_conditioned(rcond)
 
     return fac, piv
 
 
-def _cholesky(A, factor_inplace):
+def _cholesky(A, factor_inplace, check_cond=False):
     '''
     Computes the Cholesky decomposition of `A` using `dpotrf`.
     '''
     if A.shape == (0, 0):
         return np.zeros((0, 0), dtype=float)
 
+    if check_cond:
+        A_norm = dlange('1', A)
+
     L, info = dpotrf(A, lower=True, overwrite_a=factor_inplace)
     if info < 0:
         raise ValueError('The %s-th argument has an illegal value.' % -info)
     elif info > 0:
         raise np.linalg.LinAlgError('Matrix not positive definite.')
 
+    if check_cond:
+        rcond, _ = dpocon(L, A_norm, uplo='L')
+        _warn_if_ill_conditioned(rcond)
+
     return L
 
 
@@ -304,8 +322,10 @@ class _DensePosDefSolver:
     '''
     Dense positive definite matrix solver using LAPACK Cholesky decomposition.
     '''
-    def __init__(self, A, factor_inplace):
-        self.chol = _cholesky(A, factor_inplace=factor_inplace)
+    def __init__(self, A, factor_inplace, check_cond=False):
+        self.chol = _cholesky(
+            A, factor_inplace=factor_inplace, check_cond=check_cond
+            )
 
     def solve(self, b):
         '''
@@ -351,8 +371,15 @@ class PosDefSolver:
         If `True` and if `A` is fortran contiguous, then the Cholesky
         factorization of `A` is done inplace.
 
+    check_cond : bool, optional
+        If `True`, a warning is raised if `A` is ill-conditioned. Ignored if
+        `A` is sparse.
+
     '''
-    def __init__(self, A, build_inverse=False, factor_inplace=False):
+    def __init__(self, A,
+                 build_inverse=False,
+                 factor_inplace=False,
+                 check_cond=False):
         A = as_sparse_or_array(A, dtype=float)
         if sp.issparse(A):
             if not HAS_CHOLMOD:
@@ -365,7 +392,9 @@ class PosDefSolver:
                 self._solver = _SparsePosDefSolver(A)
 
         else:
-            self._solver = _DensePosDefSolver(A, factor_inplace=factor_inplace)
+            self._solver = _DensePosDefSolver(
+                A, factor_inplace=factor_inplace, check_cond=check_cond
+                )
 
         if build_inverse:
             I = np.eye(A.shape[0])
@@ -721,6 +750,70 @@ class PartitionedPosDefSolver:
         return x, y
 
 
+class MILU0Solver:
+    '''
+    Modified incomplete LU decomposition with zero fill-in, MILU(0). The
+    factors have the same sparsity pattern as `A`, and the fill-in that is
+    dropped by ILU(0) is instead added to the diagonal so that the row sums of
+    `A` are preserved. This is intended to be used as a preconditioner for
+    iterative solvers.
+
+    Parameters
+    ----------
+    A : (n, n) sparse matrix
+        The diagonals of `A` must be in its sparsity pattern.
+
+    relax : float, optional
+        Relaxation factor for the dropped fill-in. It should be between 0 and
+        1. Setting this to 0 gives the ILU(0) decomposition and setting this to
+        1 gives the MILU(0) decomposition.
+
+    '''
+    def __init__(self, A, relax=1.0):
+        # this makes a copy of the data, which gets factored inplace, and
+        # ensures that the indices are sorted with no duplicates
+        A = sp.csr_matrix(A, dtype=float, copy=True)
+        A.sum_duplicates()
+        LOGGER.debug(
+            'computing the MILU(0) decomposition of a %s by %s sparse matrix '
+            'with %s nonzeros' % (A.shape + (A.nnz,))
+            )
+        self.indptr = A.indptr.astype(np.int32, copy=False)
+        self.indices = A.indices.astype(np.int32, copy=False)
+        self.data = A.data
+        self.diag = _csr_milu0(self.indptr, self.indices, self.data, relax)
+        self.n = A.shape[0]
+
+    def solve(self, b):
+        '''
+        Solves `LUx = b` for `x`.
+
+        Parameters
+        ----------
+        b : (n,) or (n, m) array
+
+        Returns
+        -------
+        (n,) or (n, m) array
+
+        '''
+        b = np.asarray(b, dtype=float)
+        assert_shape(b, (self.n, ...), 'b')
+        if b.ndim == 1:
+            return _csr_milu0_solve(
+                self.indptr, self.indices, self.data, self.diag, b
+                )
+
+        out = np.empty(b.shape, dtype=float)
+        for i in range(b.shape[1]):
+            out[:, i] = _csr_milu0_solve(
+                self.indptr, self.indices, self.data, self.diag,
+                b[:, i]
+                )
+
+        return out
+
+
 class GMRESSolver:
     '''
     Solves the system of equations `Ax = b` for `x` iteratively with GMRES and
@@ -2,7 +2,7 @@
 This module contains functions for building two and three-dimensional weight
 matrices for linear elasticity problems.
 '''
-from rbf.pde.fd import weight_matrix
+from rbf.pde.fd import weight_matrices
 
 def elastic2d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
     '''
@@ -24,7 +24,7 @@ def elastic2d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
         Lame parameters
 
     **kwargs :
-        additional arguments passed to `weight_matrix`
+        additional arguments passed to `weight_matrices`
 
     Returns
     -------
@@ -47,10 +47,10 @@ def elastic2d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
     diffs_yy =  [(0, 2), (2, 0)]
     # make the differentiation matrices that enforce the PDE on the interior
     # nodes.
-    D_xx = weight_matrix(x, p, n, diffs_xx, coeffs=coeffs_xx, **kwargs)
-    D_xy = weight_matrix(x, p, n, diffs_xy, coeffs=coeffs_xy, **kwargs)
-    D_yx = weight_matrix(x, p, n, diffs_yx, coeffs=coeffs_yx, **kwargs)
-    D_yy = weight_matrix(x, p, n, diffs_yy, coeffs=coeffs_yy, **kwargs)
+    D_xx, D_xy, D_yx, D_yy = weight_matrices(
+        x, p, n, [diffs_xx, diffs_xy, diffs_yx, diffs_yy],
+        coeffs=[coeffs_xx, coeffs_xy, coeffs_yx, coeffs_yy],
+        **kwargs)
     return {'xx':D_xx, 'xy':D_xy, 'yx':D_yx, 'yy':D_yy}
 
 
@@ -78,7 +78,7 @@ def elastic2d_surface_force(x, nrm, p, n, lamb=1.0, mu=1.0, **kwargs):
         Lame parameters
 
     **kwargs:
-        additional arguments passed to `weight_matrix`
+        additional arguments passed to `weight_matrices`
 
     Returns
     -------
@@ -101,10 +101,10 @@ def elastic2d_surface_force(x, nrm, p, n, lamb=1.0, mu=1.0, **kwargs):
     diffs_yy =  [(1, 0), (0, 1)]
     # make the differentiation matrices that enforce the free surface boundary
     # conditions.
-    D_xx = weight_matrix(x, p, n, diffs_xx, coeffs=coeffs_xx, **kwargs)
-    D_xy = weight_matrix(x, p, n, diffs_xy, coeffs=coeffs_xy, **kwargs)
-    D_yx = weight_matrix(x, p, n, diffs_yx, coeffs=coeffs_yx, **kwargs)
-    D_yy = weight_matrix(x, p, n, diffs_yy, coeffs=coeffs_yy, **kwargs)
+    D_xx, D_xy, D_yx, D_yy = weight_matrices(
+        x, p, n, [diffs_xx, diffs_xy, diffs_yx, diffs_yy],
+        coeffs=[coeffs_xx, coeffs_xy, coeffs_yx, coeffs_yy],
+        **kwargs)
     return {'xx':D_xx, 'xy':D_xy, 'yx':D_yx, 'yy':D_yy}
 
 
@@ -125,7 +125,7 @@ def elastic2d_displacement(x, p, n, **kwargs):
         stencil size
 
     **kwargs:
-        additional arguments passed to `weight_matrix`
+        additional arguments passed to `weight_matrices`
 
     Returns
     -------
@@ -134,8 +134,7 @@ def elastic2d_displacement(x, p, n, **kwargs):
         matrices.
 
     '''
-    D_xx = weight_matrix(x, p, n, (0, 0), **kwargs)
-    D_yy = weight_matrix(x, p, n, (0, 0), **kwargs)
+    D_xx, D_yy = weight_matrices(x, p, n, [(0, 0), (0, 0)], **kwargs)
     return {'xx':D_xx, 'yy':D_yy}
 
 
@@ -159,7 +158,7 @@ def elastic3d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
         first Lame parameter
 
     **kwargs:
-        additional arguments passed to `weight_matrix`
+        additional arguments passed to `weight_matrices`
 
     Returns
     -------
@@ -186,15 +185,17 @@ def elastic3d_body_force(x, p, n, lamb=1.0, mu=1.0, **kwargs):
     diffs_zy =  [(0, 1, 1)]
     coeffs_zz = [mu, mu, lamb + 2*mu]
     diffs_zz =  [(2, 0, 0), (0, 2, 0), (0, 0, 2)]
-    D_xx = weight_matrix(x, p, n, diffs_xx, coeffs=coeffs_xx, **kwargs)
-    D_xy = weight_matrix(x, p, n, diffs_xy, coeffs=coeffs_xy, **kwargs)
-    D_xz = weight_matrix(x, p, n, diffs_xz, coeffs=coeffs_xz, **kwargs)
-    D_yx = weight_matrix(x, p, n, diffs_yx, coeffs=coeffs_yx, **kwargs)
-    D_yy = weight_matrix(x, p, n, diffs_yy, coeffs=coeffs_yy, **kwargs)
-    D_yz = weight_matrix(x, p, n, diffs_yz, coeffs=coeffs_yz, **kwargs)
-    D_zx = weight_matrix(x, p, n, diffs_zx, coeffs=coeffs_zx, **kwargs)
-    D_zy = weight_matrix(x, p, n, diffs_zy, coeffs=coeffs_zy, **kwargs)
-    D_zz = weight_matrix(x, p, n, diffs_zz, coeffs=coeffs_zz, **kwargs)
+    (D_xx, D_xy, D_xz,
+     D_yx, D_yy, D_yz,
+     D_zx, D_zy, D_zz) = weight_matrices(
+        x, p, n,
+        [diffs_xx, diffs_xy, diffs_xz,
+         diffs_yx, diffs_yy, diffs_yz,
+         diffs_zx, diffs_zy, diffs_zz],
+        coeffs=[coeffs_xx, coeffs_xy, coeffs_xz,
+                coeffs_yx, coeffs_yy, coeffs_yz,
+                coeffs_zx, coeffs_zy, coeffs_zz],
+        **kwargs)
     return {'xx':D_xx, 'xy':D_xy, 'xz':D_xz,
             'yx':D_yx, 'yy':D_yy, 'yz':D_yz,
             'zx':D_zx, 'zy':D_zy, 'zz':D_zz}
@@ -224,7 +225,7 @@ def elastic3d_surface_force(x, nrm, p, n, lamb=1.0, mu=1.0, **kwargs):
         Lame parameters
 
     **kwargs:
-        additional arguments passed to `weight_matrix`
+        additional arguments passed to `weight_matrices`
 
     Returns
     -------
@@ -251,15 +252,17 @@ def elastic3d_surface_force(x, nrm, p, n, lamb=1.0, mu=1.0, **kwargs):
     diffs_zy =  [(0, 0, 1), (0, 1, 0)]
     coeffs_zz = [nrm[:, 0]*mu, nrm[:, 1]*mu, nrm[:, 2]*(lamb + 2*mu)]
     diffs_zz =  [(1, 0, 0), (0, 1, 0), (0, 0, 1)]
-    D_xx = weight_matrix(x, p, n, diffs_xx, coeffs=coeffs_xx, **kwargs)
-    D_xy = weight_matrix(x, p, n, diffs_xy, coeffs=coeffs_xy, **kwargs)
-    D_xz = weight_matrix(x, p, n, diffs_xz, coeffs=coeffs_xz, **kwargs)
-    D_yx = weight_matrix(x, p, n, diffs_yx, coeffs=coeffs_yx, **kwargs)
-    D_yy = weight_matrix(x, p, n, diffs_yy, coeffs=coeffs_yy, **kwargs)
-    D_yz = weight_matrix(x, p, n, diffs_yz, coeffs=coeffs_yz, **kwargs)
-    D_zx = weight_matrix(x, p, n, diffs_zx, coeffs=coeffs_zx, **kwargs)
-    D_zy = weight_matrix(x, p, n, diffs_zy, coeffs=coeffs_zy, **kwargs)
-    D_zz = weight_matrix(x, p, n, diffs_zz, coeffs=coeffs_zz, **kwargs)
+    (D_xx, D_xy, D_xz,
+     D_yx, D_yy, D_yz,
+     D_zx, D_zy, D_zz) = weight_matrices(
+        x, p, n,
+        [diffs_xx, diffs_xy, diffs_xz,
+         diffs_yx, diffs_yy, diffs_yz,
+         diffs_zx, diffs_zy, diffs_zz],
+        coeffs=[coeffs_xx, coeffs_xy, coeffs_xz,
+                coeffs_yx, coeffs_yy, coeffs_yz,
+                coeffs_zx, coeffs_zy, coeffs_zz],
+        **kwargs)
     return {'xx':D_xx, 'xy':D_xy, 'xz':D_xz,
             'yx':D_yx, 'yy':D_yy, 'yz':D_yz,
             'zx':D_zx, 'zy':D_zy, 'zz':D_zz}
@@ -282,7 +285,7 @@ def elastic3d_displacement(x, p, n, **kwargs):
         stencil size
 
     **kwargs:
-        additional arguments passed to `weight_matrix`
+        additional arguments passed to `weight_matrices`
 
     Returns
     -------
@@ -291,7 +294,6 @@ def elastic3d_displacement(x, p, n, **kwargs):
         matrices.
 
     '''
-    D_xx = weight_matrix(x, p, n, (0, 0, 0), **kwargs)
-    D_yy = weight_matrix(x, p, n, (0, 0, 0), **kwargs)
-    D_zz = weight_matrix(x, p, n, (0, 0, 0), **kwargs)
+    D_xx, D_yy, D_zz = weight_matrices(
+        x, p, n, [(0, 0, 0), (0, 0, 0), (0, 0, 0)], **kwargs)
     return {'xx':D_xx, 'yy':D_yy, 'zz':D_zz}
@@ -8,7 +8,7 @@ import logging
 import numpy as np
 import scipy.sparse as sp
 
-from rbf.basis import phs3, get_rbf
+from rbf.basis import phs3, get_rbf, SparseRBF
 from rbf.poly import monomial_count, monomial_powers, mvmonos
 from rbf.utils import assert_shape, KDTree
 from rbf.linalg import as_array
@@ -98,6 +98,43 @@ def weights(x, s, diffs, coeffs=None, phi=phs3, order=None, eps=1.0):
     [1] Fornberg, B. and N. Flyer. A Primer on Radial Basis Functions with
     Applications to the Geosciences. SIAM, 2015.
 
+    '''
+    out, = _weights(x, s, [diffs], [coeffs], phi, order, eps)
+    return out
+
+
+def _weights(x, s, diffs, coeffs, phi, order, eps):
+    '''
+    Returns the RBF-FD weights for each differential operator specified with
+    `diffs` and `coeffs`. The left-hand-side of the local systems only depends
+    on the stencils, so it is built and factored once and then solved for each
+    differential operator simultaneously.
+
+    Parameters
+    ----------
+    x : (..., D) float array
+
+    s : (..., M, D) float array
+
+    diffs : list of (K, D) int arrays
+        The derivative orders for each differential operator
+
+    coeffs : list of (K, ...) float arrays
+        The coefficients for each differential operator. An element can be
+        None for coefficients of ones.
+
+    phi : rbf.basis.RBF instance or str
+
+    order : int or None
+        Order of the added polynomial. If this is None, then it is set to the
+        highest derivative order among all the differential operators.
+
+    eps : float or float array
+
+    Returns
+    -------
+    list of (..., M) float arrays
+
     '''
     x = np.asarray(x, dtype=float)
     assert_shape(x, (..., None), 'x')
@@ -110,18 +147,22 @@ def weights(x, s, diffs, coeffs=None, phi=phs3, order=None, eps=1.0):
     s = np.broadcast_to(s, bcast + s.shape[-2:])
     ssize = s.shape[-2]
 
-    diffs = np.asarray(diffs, dtype=int)
-    diffs = np.atleast_2d(diffs)
-    assert_shape(diffs, (None, ndim), 'diffs')
+    diffs = [np.atleast_2d(np.asarray(d, dtype=int)) for d in diffs]
+    for d in diffs:
+        assert_shape(d, (None, ndim), 'diffs')
 
-    if coeffs is None:
-        coeffs = np.ones(len(diffs), dtype=float)
-    else:
-        coeffs = np.asarray(coeffs, dtype=float)
-        assert_shape(coeffs, (len(diffs), ...), 'coeffs')
+    coeffs_list = []
+    for c, d in zip(coeffs, diffs):
+        if c is None:
+            c = np.ones(len(d), dtype=float)
+        else:
+            c = np.asarray(c, dtype=float)
+            assert_shape(c, (len(d), ...), 'coeffs')
+
+        # broadcast each element in `c` to match leading dimensions of `x`
+        coeffs_list.append([np.broadcast_to(ci, bcast) for ci in c])
 
-    # broadcast each element in `coeffs` to match leading dimensions of `x`
-    coeffs = [np.broadcast_to(c, bcast) for c in coeffs]
+    coeffs = coeffs_list
 
     phi = get_rbf(phi)
 
@@ -130,7 +171,7 @@ def weights(x, s, diffs, coeffs=None, phi=phs3, order=None, eps=1.0):
     if order is None:
         # If the polynomial order is not specified, make it equal to the
         # derivative order, provided that the stencil size is large enough.
-        order = diffs.sum(axis=1).max()
+        order = max(d.sum(axis=1).max() for d in diffs)
         order = min(order, max_order)
 
     if order > max_order:
@@ -143,26 +184,40 @@ def weights(x, s, diffs, coeffs=None, phi=phs3, order=None, eps=1.0):
     # get the powers for the added monomials
     pwr = monomial_powers(order, ndim)
     # evaluate the RBF and monomials at each point in the stencil. This becomes
-    # the left-hand-side
-    A = phi(s, s, eps=eps)
-    P = mvmonos(s, pwr)
-    Pt = P.swapaxes(-2, -1)
-    Z = np.zeros(bcast + (len(pwr), len(pwr)), dtype=float)
-    LHS = np.block([[A, P], [Pt, Z]])
-    # Evaluate the RBF and monomials at the target points for each term in the
-    # differential operator. This becomes the right-hand-side.
-    a, p = 0.0, 0.0
-    for c, d in zip(coeffs, diffs):
-        a += c[..., None, None]*phi(x, s, eps=eps, diff=d)
-        p += c[..., None, None]*mvmonos(x, pwr, diff=d)
-
-    # convert `a` to an array because phi may be a sparse RBF
-    a = as_array(a)[..., 0, :]
-    p = p[..., 0, :]
-    rhs = np.concatenate((a, p), axis=-1)
+    # the left-hand-side. The blocks are written directly into a preallocated
+    # array to avoid making copies of them.
+    r = len(pwr)
+    LHS = np.empty(bcast + (ssize + r, ssize + r), dtype=float)
+    if isinstance(phi, SparseRBF):
+        LHS[..., :ssize, :ssize] = as_array(phi(s, s, eps=eps))
+    else:
+        phi(s, s, eps=eps, out=LHS[..., :ssize, :ssize])
 
-    w = np.linalg.solve(LHS, rhs)[..., :ssize]
-    return w
+    P = mvmonos(s, pwr)
+    LHS[..., :ssize, ssize:] = P
+    LHS[..., ssize:, :ssize] = P.swapaxes(-2, -1)
+    LHS[..., ssize:, ssize:] = 0.0
+    # Evaluate the RBF and monomials at the target points for each term in each
+    # differential operator. This becomes the right-hand-side, which has one
+    # column per differential operator. The terms are accumulated directly
+    # into the preallocated right-hand-side, and the RBF and monomials are only
+    # evaluated once for each unique derivative.
+    rhs = np.zeros(bcast + (ssize + r, len(diffs)), dtype=float)
+    phi_cache, mono_cache = {}, {}
+    for i, (c_op, d_op) in enumerate(zip(coeffs, diffs)):
+        for c, d in zip(c_op, d_op):
+            d = tuple(d)
+            if d not in phi_cache:
+                # convert to an array because phi may be a sparse RBF
+                phi_cache[d] = as_array(phi(x, s, eps=eps, diff=d))[..., 0, :]
+                mono_cache[d] = mvmonos(x, pwr, diff=d)[..., 0, :]
+
+            rhs[..., :ssize, i] += c[..., None]*phi_cache[d]
+            rhs[..., ssize:, i] += c[..., None]*mono_cache[d]
+
+    w = np.linalg.solve(LHS, rhs)[..., :ssize, :]
+    out = [w[..., i] for i in range(len(diffs))]
+    return out
 
 
 def weight_matrix(x, p, n, diffs,
@@ -170,7 +225,9 @@ def weight_matrix(x, p, n, diffs,
                   phi='phs3',
                   order=None,
                   eps=1.0,
-                  chunk_size=1000):
+                  chunk_size=1000,
+                  row_map=None,
+                  nrows=None):
     '''
     Returns a weight matrix which maps a function's values at `p` to an
     approximation of that function's derivative at `x`. This is a convenience
@@ -219,9 +276,22 @@ def weight_matrix(x, p, n, diffs,
         Break the target points into chunks with this size to reduce the memory
         requirements
 
+    row_map : (N,) int array, optional
+        The row in the output matrix that each target point is assigned to.
+        This is equivalent to, but more efficient than, expanding the rows of
+        the output matrix with `rbf.sputils.expand_rows`. Defaults to
+        `range(N)`.
+
+    nrows : int, optional
+        The number of rows in the output matrix. If `row_map` is not given,
+        this defaults to N and it must be at least N, where the rows after the
+        first N are empty. Otherwise, this defaults to M so that the output
+        matrix is square.
+
     Returns
     -------
-    (N, M) coo sparse matrix
+    (N, M) csr sparse matrix
+        If `row_map` is given, this is a (`nrows`, M) matrix
 
     Examples
     --------
@@ -235,6 +305,102 @@ def weight_matrix(x, p, n, diffs,
            [ 0.,  1., -2., 1.],
            [ 0.,  1., -2., 1.]])
 
+    '''
+    out, = weight_matrices(
+        x, p, n, [diffs],
+        coeffs=[coeffs],
+        phi=phi,
+        order=order,
+        eps=eps,
+        chunk_size=chunk_size,
+        row_map=row_map,
+        nrows=nrows)
+    return out
+
+
+def weight_matrices(x, p, n, diffs,
+                    coeffs=None,
+                    phi='phs3',
+                    order=None,
+                    eps=1.0,
+                    chunk_size=1000,
+                    row_map=None,
+                    nrows=None):
+    '''
+    Returns a weight matrix for each of several differential operators. The
+    stencils, the polynomial order, and the left-hand-side of the local RBF-FD
+    systems are shared between the differential operators, which is more
+    efficient than calling `weight_matrix` for each differential operator.
+
+    The output is the same as calling `weight_matrix` for each differential
+    operator with the same `order`. If `order` is not given, it is taken from
+    the highest derivative order among all the differential operators, so the
+    weights for a lower order differential operator can differ from those
+    returned by calling `weight_matrix` with its default `order`.
+
+    Parameters
+    ----------
+    x : (N, D) float array
+        Target points where the derivatives are being approximated
+
+    p : (M, D) array
+        Source points. The derivatives will be approximated with a weighted sum
+        of values at these point.
+
+    n : int
+        The stencil size. Each target point will have a stencil made of the `n`
+        nearest neighbors from `p`
+
+    diffs : list of (D,) or (K, D) int arrays
+        Derivative orders for each differential operator. See `weight_matrix`
+        for a description of each element.
+
+    coeffs : list of (K,) or (K, N) float arrays, optional
+        Coefficients for each differential operator. An element can be None for
+        coefficients of ones. Defaults to coefficients of ones for every
+        differential operator.
+
+    phi : rbf.basis.RBF instance or str, optional
+        Type of RBF. Select from those available in `rbf.basis` or create your
+        own.
+
+    order : int, optional
+        Order of the added polynomial, which is shared by all the differential
+        operators. This defaults to the highest derivative order among all the
+        differential operators.
+
+    eps : float, optional
+        Shape parameter for each RBF
+
+    chunk_size : int, optional
+        Break the target points into chunks with this size to reduce the memory
+        requirements
+
+    row_map : (N,) int array, optional
+        The row in the output matrix that each target point is assigned to.
+        This is equivalent to, but more efficient than, expanding the rows of
+        the output matrix with `rbf.sputils.expand_rows`. Defaults to
+        `range(N)`.
+
+    nrows : int, optional
+        The number of rows in the output matrix. If `row_map` is not given,
+        this defaults to N and it must be at least N, where the rows after the
+        first N are empty. Otherwise, this defaults to M so that the output
+        matrix is square.
+
+    Returns
+    -------
+    list of (N, M) csr sparse matrices
+        If `row_map` is given, these are (`nrows`, M) matrices
+
+    Examples
+    --------
+    Create differentiation matrices for the x and y derivatives in
+    two-dimensional space
+
+    >>> x = np.random.random((20, 2))
+    >>> Wx, Wy = weight_matrices(x, x, 6, [(1, 0), (0, 1)])
+
     '''
     x = np.asarray(x, dtype=float)
     assert_shape(x, (None, None), 'x')
@@ -243,40 +409,84 @@ def weight_matrix(x, p, n, diffs,
     p = np.asarray(p, dtype=float)
     assert_shape(p, (None, ndim), 'p')
 
-    diffs = np.asarray(diffs, dtype=int)
-    diffs = np.atleast_2d(diffs)
-    assert_shape(diffs, (None, ndim), 'diffs')
+    diffs = [np.atleast_2d(np.asarray(d, dtype=int)) for d in diffs]
+    for d in diffs:
+        assert_shape(d, (None, ndim), 'diffs')
 
     if coeffs is None:
-        coeffs = np.ones(len(diffs), dtype=float)
+        coeffs = [None]*len(diffs)
+    elif len(coeffs) != len(diffs):
+        raise ValueError('`coeffs` must have the same length as `diffs`.')
+
+    coeffs_list = []
+    for c, d in zip(coeffs, diffs):
+        if c is None:
+            c = np.ones(len(d), dtype=float)
+        else:
+            c = np.asarray(c, dtype=float)
+            assert_shape(c, (len(d), ...), 'coeffs')
+
+        # broadcast each element in `c` to the length of `x`
+        coeffs_list.append(np.array([np.broadcast_to(ci, (nx,)) for ci in c]))
+
+    coeffs = coeffs_list
+
+    if row_map is None:
+        if nrows is None:
+            nrows = nx
+        elif nrows < nx:
+            raise ValueError(
+                '`nrows` must be at least %d when `row_map` is not given.' % nx)
+
     else:
-        coeffs = np.asarray(coeffs, dtype=float)
-        assert_shape(coeffs, (len(diffs), ...), 'coeffs')
+        row_map = np.asarray(row_map, dtype=int)
+        assert_shape(row_map, (nx,), 'row_map')
+        if nrows is None:
+            nrows = len(p)
 
-    # broadcast each element in `coeffs` to the length of `x`
-    coeffs = np.array([np.broadcast_to(c, (nx,)) for c in coeffs])
+        if np.any((row_map < 0) | (row_map >= nrows)):
+            raise ValueError(
+                '`row_map` must only contain values between 0 and %d.' %
+                (nrows - 1))
+
+    if len(diffs) == 0:
+        return []
 
     _, stencils = KDTree(p).query(x, n)
     if chunk_size is None:
-        data = weights(
-            x, p[stencils], diffs,
-            coeffs=coeffs,
-            phi=phi,
-            order=order,
-            eps=eps)
+        data = _weights(x, p[stencils], diffs, coeffs, phi, order, eps)
     else:
-        data = np.empty((nx, n), dtype=float)
+        data = [np.empty((nx, n), dtype=float) for _ in diffs]
         for start in range(0, nx, chunk_size):
             stop = start + chunk_size
-            data[start:stop] = weights(
+            chunk_data = _weights(
                 x[start:stop], p[stencils[start:stop]], diffs,
-                coeffs=coeffs[:, start:stop],
-                phi=phi,
-                order=order,
-                eps=eps)
-
-    data = data.ravel()
-    rows = np.repeat(range(nx), n)
-    cols = stencils.ravel()
-    out = sp.coo_matrix((data, (rows, cols)), (nx, len(p)))
+                [c[:, start:stop] for c in coeffs],
+                phi, order, eps)
+            for dat, chunk_dat in zip(data, chunk_data):
+                dat[start:stop] = chunk_dat
+
+    # Build the CSR arrays directly. If `row_map` is given, the target points
+    # are sorted by their row in the output matrix so that each row's weights
+    # are contiguous.
+    if row_map is None:
+        indptr = np.full(nrows + 1, n*nx, dtype=int)
+        indptr[:nx + 1] = np.arange(0, n*nx + 1, n)
+        indices = stencils.ravel()
+        data = [dat.ravel() for dat in data]
+    else:
+        sort_idx = np.argsort(row_map, kind='stable')
+        indptr = np.zeros(nrows + 1, dtype=int)
+        np.cumsum(n*np.bincount(row_map, minlength=nrows), out=indptr[1:])
+        indices = stencils[sort_idx].ravel()
+        data = [dat[sort_idx].ravel() for dat in data]
+
+    # each matrix gets its own copy of `indices` and `indptr` because scipy may
+    # sort the indices of a matrix inplace.
+    out = [
+        sp.csr_matrix(
+            (dat, indices.copy(), indptr.copy()), shape=(nrows, len(p))
+            )
+        for dat in data
+        ]
     return out
@@ -9,6 +9,7 @@ import scipy.sparse as sp
 from rbf.utils import assert_shape
 
 from cython cimport boundscheck, wraparound
+from cython.parallel cimport prange
 
 logger = logging.getLogger(__name__)
 
@@ -215,3 +216,233 @@ def expand_cols(A, cols, cout, copy=False):
 
     out = sp.coo_matrix((A.data, (A.row, cols[A.col])), shape=(rin, cout))
     return out
+
+
+@boundscheck(False)
+@wraparound(False)
+def _csr_shared_pattern_dot(const int[:] indptr,
+                            const int[:] indices,
+                            const double[:, :] data,
+                            const double[:, :] x):
+    '''
+    Computes the product of `x` with each of the CSR matrices whose data are
+    the columns of `data` and which share `indptr` and `indices`.
+    '''
+    cdef:
+        long i, j, k, l, col
+        long n = indptr.shape[0] - 1
+        long nmats = data.shape[1]
+        long s = x.shape[1]
+        double[:, :, :] out = np.zeros((nmats, n, s), dtype=float)
+
+    for i in range(n):
+        for j in range(indptr[i], indptr[i + 1]):
+            col = indices[j]
+            for k in range(nmats):
+                for l in range(s):
+                    out[k, i, l] += data[j, k]*x[col, l]
+
+    return np.asarray(out)
+
+
+def shared_pattern_dot(mats, x):
+    '''
+    Computes the product of `x` with each sparse matrix in `mats`, which must
+    all have the same sparsity pattern. This is equivalent to `[A.dot(x) for A
+    in mats]`, except that the sparsity pattern is only traversed once.
+
+    Parameters
+    ----------
+    mats : list of (n, m) sparse matrices
+        CSR matrices for best efficiency
+
+    x : (m,) or (m, s) float array
+
+    Returns
+    -------
+    list of (n,) or (n, s) float arrays
+
+    '''
+    mats = [sp.csr_matrix(A, dtype=float) for A in mats]
+    if len(mats) == 0:
+        return []
+
+    indptr, indices = mats[0].indptr, mats[0].indices
+    for A in mats[1:]:
+        if ((A.shape != mats[0].shape) or
+            (not np.array_equal(A.indptr, indptr)) or
+            (not np.array_equal(A.indices, indices))):
+            raise ValueError(
+                'The sparse matrices do not have the same sparsity pattern.')
+
+    x = np.asarray(x, dtype=float)
+    assert_shape(x, (mats[0].shape[1], ...), 'x')
+    x_2d = x.reshape((x.shape[0], -1))
+
+    # store the data for each matrix in the columns of a C contiguous array so
+    # that they are adjacent in memory
+    data = np.column_stack([A.data for A in mats])
+    out = _csr_shared_pattern_dot(
+        indptr.astype(np.int32, copy=False),
+        indices.astype(np.int32, copy=False),
+        data,
+        x_2d)
+    out = [o.reshape((o.shape[0],) + x.shape[1:]) for o in out]
+    return out
+
+
+@boundscheck(False)
+@wraparound(False)
+def _csr_matvec(const int[:] indptr,
+                const int[:] indices,
+                const double[:] data,
+                const double[:] x):
+    '''
+    Computes the product of a CSR matrix and a vector. The rows are
+    distributed between threads if this module was compiled with OpenMP.
+    '''
+    cdef:
+        long i, j
+        long n = indptr.shape[0] - 1
+        double s
+        double[:] out = np.empty((n,), dtype=float)
+
+    for i in prange(n, nogil=True, schedule='static'):
+        s = 0.0
+        for j in range(indptr[i], indptr[i + 1]):
+            s = s + data[j]*x[indices[j]]
+
+        out[i] = s
+
+    return np.asarray(out)
+
+
+def parallel_dot(A, x):
+    '''
+    Computes the product of the sparse matrix `A` and `x`. This is equivalent
+    to `A.dot(x)`, except that the product is multithreaded if RBF was built
+    with OpenMP.
+
+    Parameters
+    ----------
+    A : (n, m) sparse matrix
+        CSR matrix for best efficiency
+
+    x : (m,) or (m, s) float array
+
+    Returns
+    -------
+    (n,) or (n, s) float array
+
+    '''
+    A = sp.csr_matrix(A, dtype=float)
+    x = np.asarray(x, dtype=float)
+    assert_shape(x, (A.shape[1], ...), 'x')
+    indptr = A.indptr.astype(np.int32, copy=False)
+    indices = A.indices.astype(np.int32, copy=False)
+    if x.ndim == 1:
+        return _csr_matvec(indptr, indices, A.data, x)
+
+    x_2d = x.reshape((x.shape[0], -1))
+    out = np.empty((A.shape[0], x_2d.shape[1]), dtype=float)
+    for i in range(x_2d.shape[1]):
+        out[:, i] = _csr_matvec(indptr, indices, A.data, x_2d[:, i])
+
+    out = out.reshape((A.shape[0],) + x.shape[1:])
+    return out
+
+
+@boundscheck(False)
+@wraparound(False)
+def _csr_milu0(const int[:] indptr,
+               const int[:] indices,
+               double[:] data,
+               double relax):
+    '''
+    Computes the modified incomplete LU factorization with zero fill-in of a
+    CSR matrix. The matrix must have sorted indices and no duplicate entries.
+    The factorization is written to `data` in place, where the strictly lower
+    entries are for the unit lower triangular factor and the remaining entries
+    are for the upper triangular factor. Fill-in that would be dropped by
+    ILU(0) is scaled by `relax` and added to the diagonal. Returns the
+    position of the diagonal in each row.
+    '''
+    cdef:
+        long i, j, k, ij, ik, kj
+        long n = indptr.shape[0] - 1
+        double lik
+        long[:] diag = np.full((n,), -1, dtype=int)
+        # maps a column index to its position in the current row, or -1 if
+        # the column is not in the sparsity pattern of the row
+        long[:] pos = np.full((n,), -1, dtype=int)
+
+    for i in range(n):
+        for ij in range(indptr[i], indptr[i + 1]):
+            if indices[ij] == i:
+                diag[i] = ij
+                break
+
+        if diag[i] == -1:
+            raise np.linalg.LinAlgError(
+                'The diagonal of row %d is not in the sparsity pattern.' % i)
+
+    for i in range(n):
+        for ij in range(indptr[i], indptr[i + 1]):
+            pos[indices[ij]] = ij
+
+        # eliminate the entries in the lower triangle of row `i`. The pivots
+        # for the preceding rows are already final.
+        for ik in range(indptr[i], diag[i]):
+            k = indices[ik]
+            data[ik] /= data[diag[k]]
+            lik = data[ik]
+            for kj in range(diag[k] + 1, indptr[k + 1]):
+                j = indices[kj]
+                if pos[j] != -1:
+                    data[pos[j]] -= lik*data[kj]
+                else:
+                    data[diag[i]] -= relax*lik*data[kj]
+
+        if data[diag[i]] == 0.0:
+            raise np.linalg.LinAlgError('Singular matrix.')
+
+        for ij in range(indptr[i], indptr[i + 1]):
+            pos[indices[ij]] = -1
+
+    return np.asarray(diag)
+
+
+@boundscheck(False)
+@wraparound(False)
+def _csr_milu0_solve(const int[:] indptr,
+                     const int[:] indices,
+                     const double[:] data,
+                     const long[:] diag,
+                     const double[:] b):
+    '''
+    Solves `LUx = b` for `x`, where `L` and `U` are the factors computed by
+    `_csr_milu0`.
+    '''
+    cdef:
+        long i, ij
+        long n = indptr.shape[0] - 1
+        double s
+        double[:] work = np.empty((n,), dtype=float)
+
+    # forward substitution with the unit lower triangular factor
+    for i in range(n):
+        s = b[i]
+        for ij in range(indptr[i], diag[i]):
+            s -= data[ij]*work[indices[ij]]
+
+        work[i] = s
+
+    # backward substitution with the upper triangular factor
+    for i in range(n - 1, -1, -1):
+        s = work[i]
+        for ij in range(diag[i] + 1, indptr[i + 1]):
+            s -= data[ij]*work[indices[ij]]
+
+        work[i] = s/data[diag[i]]
+
+    return np.asarray(work)
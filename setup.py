@@ -5,6 +5,7 @@ if __name__ == '__main__':
     from Cython.Build import cythonize
     from pathlib import Path
     import subprocess as sp
+    import sys
     import numpy as np
     import json
     import re
@@ -19,7 +20,16 @@ if __name__ == '__main__':
 
     cy_ext = []
     cy_ext += [Extension(name='rbf.poly', sources=['rbf/poly.pyx'])]
-    cy_ext += [Extension(name='rbf.sputils', sources=['rbf/sputils.pyx'])]
+    # build `rbf.sputils` with OpenMP on Linux to parallelize the sparse
+    # matrix-vector products. The OpenMP loops run serially without it.
+    if sys.platform.startswith('linux'):
+        openmp_args = ['-fopenmp']
+    else:
+        openmp_args = []
+
+    cy_ext += [Extension(name='rbf.sputils', sources=['rbf/sputils.pyx'],
+                         extra_compile_args=openmp_args,
+                         extra_link_args=openmp_args)]
     cy_ext += [Extension(name='rbf.pde.halton', sources=['rbf/pde/halton.pyx'])]
     cy_ext += [Extension(name='rbf.pde.geometry', sources=['rbf/pde/geometry.pyx'])]
     cy_ext += [Extension(name='rbf.pde.sampling', sources=['rbf/pde/sampling.pyx'])]
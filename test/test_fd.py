@@ -2,6 +2,7 @@ import numpy as np
 import rbf.basis
 import rbf.pde.fd
 import rbf.pde.halton
+import rbf.sputils
 import unittest
 
 def test_func2d(x):
@@ -177,3 +178,68 @@ class Test(unittest.TestCase):
     w = rbf.pde.fd.weights(x,nodes,(0,1),
                        phi=rbf.basis.phs8)
     self.assertTrue(np.isclose(u.dot(w),diff_true,atol=1e-2))
+
+  def test_weight_matrices(self):
+    # `weight_matrices` should be equivalent to calling `weight_matrix` for
+    # each differential operator with the same `order`
+    H = rbf.pde.halton.HaltonSequence(2, start=0)
+    nodes = H(200)
+    x = H(50)
+    diffs = [[(2, 0), (0, 2)], (1, 0), [(0, 1), (1, 1)]]
+    coeffs = [None, [2.0], [np.linspace(1.0, 2.0, 50), np.full(50, 3.0)]]
+    out = rbf.pde.fd.weight_matrices(
+      x, nodes, 20, diffs, coeffs=coeffs, order=2, chunk_size=15)
+    for W1, d, c in zip(out, diffs, coeffs):
+      W2 = rbf.pde.fd.weight_matrix(x, nodes, 20, d, coeffs=c, order=2)
+      self.assertTrue(np.allclose(W1.toarray(), W2.toarray()))
+
+  def test_weight_matrices_default_order(self):
+    # the default `order` is the highest derivative order among all the
+    # differential operators
+    H = rbf.pde.halton.HaltonSequence(2, start=0)
+    nodes = H(200)
+    x = H(50)
+    Wx, Wy = rbf.pde.fd.weight_matrices(x, nodes, 20, [(1, 0), (0, 1)])
+    self.assertTrue(np.allclose(
+      Wx.toarray(), rbf.pde.fd.weight_matrix(x, nodes, 20, (1, 0)).toarray()))
+    self.assertTrue(np.allclose(
+      Wy.toarray(), rbf.pde.fd.weight_matrix(x, nodes, 20, (0, 1)).toarray()))
+
+    W1, W2 = rbf.pde.fd.weight_matrices(x, nodes, 20, [(1, 0), (2, 0)])
+    self.assertTrue(np.allclose(
+      W1.toarray(),
+      rbf.pde.fd.weight_matrix(x, nodes, 20, (1, 0), order=2).toarray()))
+    self.assertFalse(np.allclose(
+      W1.toarray(), rbf.pde.fd.weight_matrix(x, nodes, 20, (1, 0)).toarray()))
+    self.assertTrue(np.allclose(
+      W2.toarray(), rbf.pde.fd.weight_matrix(x, nodes, 20, (2, 0)).toarray()))
+
+  def test_weight_matrix_row_map(self):
+    # `row_map` should be equivalent to expanding the rows with
+    # `rbf.sputils.expand_rows`
+    H = rbf.pde.halton.HaltonSequence(2, start=0)
+    nodes = H(100)
+    rows = np.random.choice(100, 30, replace=False)
+    W1 = rbf.pde.fd.weight_matrix(
+      nodes[rows], nodes, 10, [(2, 0), (0, 2)], row_map=rows)
+    W2 = rbf.pde.fd.weight_matrix(nodes[rows], nodes, 10, [(2, 0), (0, 2)])
+    W2 = rbf.sputils.expand_rows(W2, rows, 100)
+    self.assertEqual(W1.shape, (100, 100))
+    self.assertTrue(np.allclose(W1.toarray(), W2.toarray()))
+
+  def test_weight_matrix_nrows(self):
+    # without `row_map`, the rows after the first N should be empty
+    H = rbf.pde.halton.HaltonSequence(2, start=0)
+    nodes = H(100)
+    W1 = rbf.pde.fd.weight_matrix(nodes[:30], nodes, 10, [(2, 0)], nrows=50)
+    W2 = rbf.pde.fd.weight_matrix(nodes[:30], nodes, 10, [(2, 0)])
+    self.assertEqual(W1.shape, (50, 100))
+    self.assertTrue(np.allclose(W1.toarray()[:30], W2.toarray()))
+    self.assertEqual(W1[30:].nnz, 0)
+    with self.assertRaises(ValueError):
+      rbf.pde.fd.weight_matrix(nodes[:30], nodes, 10, [(2, 0)], nrows=20)
+
+  def test_weight_matrices_empty(self):
+    H = rbf.pde.halton.HaltonSequence(2, start=0)
+    nodes = H(100)
+    self.assertEqual(rbf.pde.fd.weight_matrices(nodes, nodes, 10, []), [])
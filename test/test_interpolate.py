@@ -281,6 +281,65 @@ class Test(unittest.TestCase):
         value2 = np.linalg.norm(errors)
         self.assertTrue(np.isclose(value1, value2))
 
+    def test_dtype_eval(self):
+        # evaluating with single precision coefficients should give nearly the
+        # same result as double precision, and the output should still be
+        # double precision
+        N = 100
+        P = 100
+        H = rbf.pde.halton.HaltonSequence(2)
+        obs = H(N)
+        itp = H(P)
+        val = test_func2d(obs)
+
+        I1 = RBFInterpolant(obs, val, phi=rbf.basis.phs3, order=1)
+        I2 = RBFInterpolant(
+            obs, val, phi=rbf.basis.phs3, order=1, dtype_eval=np.float32
+            )
+        self.assertEqual(I2.phi_coeff.dtype, np.float32)
+        valitp1 = I1(itp)
+        valitp2 = I2(itp)
+        self.assertEqual(valitp2.dtype, np.float64)
+        self.assertTrue(np.allclose(valitp1, valitp2, atol=1e-2))
+
+        with self.assertRaises(ValueError):
+            RBFInterpolant(obs, val, dtype_eval=int)
+
+    def test_neighbors_kdtree_cache(self):
+        # interpolants with the same observation points should share the
+        # KD-tree
+        N = 100
+        H = rbf.pde.halton.HaltonSequence(2)
+        obs = H(N)
+        val = test_func2d(obs)
+
+        I1 = RBFInterpolant(obs, val, neighbors=20)
+        I2 = RBFInterpolant(obs.copy(), 2*val, neighbors=20)
+        I3 = RBFInterpolant(obs[:50], val[:50], neighbors=20)
+        self.assertIs(I1.tree, I2.tree)
+        self.assertIsNot(I1.tree, I3.tree)
+
+    def test_positive_definite_no_poly(self):
+        # a positive definite RBF with no polynomial terms is solved with a
+        # Cholesky factorization and should still interpolate the data
+        N = 100
+        H = rbf.pde.halton.HaltonSequence(2)
+        obs = H(N)
+        val = test_func2d(obs)
+        I = RBFInterpolant(obs, val, sigma=0.1, phi='ga', eps=5.0, order=-1)
+        K = rbf.basis.ga(obs, obs, eps=5.0) + 0.01*np.eye(N)
+        self.assertTrue(np.allclose(K.dot(I.phi_coeff[:, 0]), val))
+
+    def test_positive_definite_no_poly_check_cond(self):
+        # the Cholesky factorization should still warn about an
+        # ill-conditioned system
+        N = 100
+        H = rbf.pde.halton.HaltonSequence(2)
+        obs = H(N)
+        val = test_func2d(obs)
+        with self.assertWarns(scipy.linalg.LinAlgWarning):
+            RBFInterpolant(obs, val, phi='ga', eps=2.0, order=-1)
+
 #unittest.main()
 
 
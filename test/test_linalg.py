@@ -2,6 +2,7 @@ import numpy as np
 import rbf.linalg
 import unittest
 import scipy.sparse as sp
+import scipy.linalg
 np.random.seed(1)
 
 
@@ -299,3 +300,51 @@ class Test(unittest.TestCase):
                 np.hstack((B.T,np.zeros((2,2)))))))
     soln2 = Cinv.dot(np.hstack((a,b)))
     self.assertTrue(np.allclose(soln1,soln2))
+
+  def test_pos_def_solver_check_cond(self):
+    # an ill-conditioned positive definite matrix should warn if `check_cond`
+    # is True
+    A = np.diag([1.0, 1e-20])
+    with self.assertWarns(scipy.linalg.LinAlgWarning):
+      rbf.linalg.PosDefSolver(A, check_cond=True)
+
+  def test_milu0_solver_full_pattern(self):
+    # ILU(0) of a matrix with a full sparsity pattern is the exact LU
+    # decomposition
+    n = 20
+    A = np.random.random((n, n)) + n*np.eye(n)
+    b = np.random.random((n,))
+    x1 = np.linalg.solve(A, b)
+    x2 = rbf.linalg.MILU0Solver(sp.csc_matrix(A), relax=0.0).solve(b)
+    self.assertTrue(np.allclose(x1, x2))
+
+  def test_milu0_solver_row_sums(self):
+    # the MILU(0) decomposition preserves the row sums of `A`
+    n = 100
+    A = sp.rand(n, n, density=0.1) + n*sp.eye(n)
+    A = A.tocsr()
+    b = A.dot(np.ones(n))
+    x = rbf.linalg.MILU0Solver(A).solve(b)
+    self.assertTrue(np.allclose(x, np.ones(n)))
+
+  def test_milu0_solver_multiple_rhs(self):
+    n = 100
+    A = sp.rand(n, n, density=0.1) + n*sp.eye(n)
+    b = np.random.random((n, 3))
+    solver = rbf.linalg.MILU0Solver(A)
+    x1 = solver.solve(b)
+    x2 = np.array([solver.solve(bi) for bi in b.T]).T
+    self.assertTrue(np.allclose(x1, x2))
+
+  def test_milu0_solver_read_only(self):
+    # read-only right-hand sides and matrices should be accepted
+    n = 100
+    A = (sp.rand(n, n, density=0.1) + n*sp.eye(n)).tocsr()
+    A.data.flags.writeable = False
+    b = np.broadcast_to(1.0, (n,))
+    solver = rbf.linalg.MILU0Solver(A)
+    x1 = solver.solve(b)
+    x2 = solver.solve(np.ones(n))
+    self.assertTrue(np.allclose(x1, x2))
+    x3 = solver.solve(np.broadcast_to(1.0, (n, 2)))
+    self.assertTrue(np.allclose(x3, x2[:, None]))
@@ -47,3 +47,52 @@ class Test(unittest.TestCase):
     D[idx, :] += B
     
     self.assertTrue(np.allclose(C.A, D.A))
+
+  def test_shared_pattern_dot(self):
+    A = sp.rand(100, 50, 0.1).tocsr()
+    B = A.copy()
+    B.data = np.random.random(B.data.shape)
+    x = np.random.random((50,))
+    out = rbf.sputils.shared_pattern_dot([A, B], x)
+    self.assertTrue(np.allclose(out[0], A.dot(x)))
+    self.assertTrue(np.allclose(out[1], B.dot(x)))
+
+    x = np.random.random((50, 3))
+    out = rbf.sputils.shared_pattern_dot([A, B], x)
+    self.assertTrue(np.allclose(out[0], A.dot(x)))
+    self.assertTrue(np.allclose(out[1], B.dot(x)))
+
+  def test_shared_pattern_dot_read_only(self):
+    A = sp.rand(100, 50, 0.1).tocsr()
+    B = A.copy()
+    B.data = np.random.random(B.data.shape)
+    x = np.broadcast_to(2.0, (50, 3))
+    out = rbf.sputils.shared_pattern_dot([A, B], x)
+    self.assertTrue(np.allclose(out[0], A.dot(x)))
+    self.assertTrue(np.allclose(out[1], B.dot(x)))
+
+  def test_shared_pattern_dot_mismatch(self):
+    A = sp.rand(100, 50, 0.1).tocsr()
+    B = sp.rand(100, 50, 0.1).tocsr()
+    x = np.random.random((50,))
+    with self.assertRaises(ValueError):
+      rbf.sputils.shared_pattern_dot([A, B], x)
+
+  def test_parallel_dot(self):
+    A = sp.rand(100, 50, 0.1).tocsr()
+    x = np.random.random((50,))
+    out = rbf.sputils.parallel_dot(A, x)
+    self.assertTrue(np.allclose(out, A.dot(x)))
+
+  def test_parallel_dot_read_only(self):
+    A = sp.rand(100, 50, 0.1).tocsr()
+    A.data.flags.writeable = False
+    x = np.broadcast_to(2.0, (50,))
+    out = rbf.sputils.parallel_dot(A, x)
+    self.assertTrue(np.allclose(out, A.dot(x)))
+
+  def test_parallel_dot_multiple_columns(self):
+    A = sp.rand(100, 50, 0.1).tocsr()
+    x = np.random.random((50, 3))
+    out = rbf.sputils.parallel_dot(A, x)
+    self.assertTrue(np.allclose(out, A.dot(x)))